@@ -38,5 +38,8 @@ setup(name='lfc',
       ],
       test_suite='nose.collector',
       install_requires=REQUIREMENTS,
+      entry_points={
+          'console_scripts': ['lfc=lfc.cli:main'],
+      },
 
       )
@@ -0,0 +1,183 @@
+import hashlib
+import threading
+import time
+from collections import Counter
+from config import MAX_RELATIVE_EXPIRE
+
+
+class AdmissionRejectedError(Exception):
+    """Raised when a file is not admitted and `raise_on_error` is set"""
+
+
+class FrequencySketch(object):
+    """
+        A count-min sketch that estimates how often a key has been seen,
+        using a few small counters per key instead of one entry per key.
+        Like in TinyLFU, all the counters are halved every `sample_size`
+        increments so that old popularity fades away.
+    """
+
+    _max_count = 15  # 4-bit counters, as in TinyLFU
+
+    def __init__(self, width=1024, depth=4, sample_size=None):
+        assert depth <= 4, "Depth can be at most 4."
+        self.width = width
+        self.depth = depth
+        self.sample_size = sample_size or 10 * width
+        self._table = [[0] * width for _ in range(depth)]
+        self._additions = 0
+
+    def _indexes(self, key):
+        """
+        Returns the counter index of the key in each row of the table
+        :param key: str, the key
+        :return: list[int]
+        """
+        if not isinstance(key, bytes):
+            key = key.encode('utf-8')
+        digest = hashlib.md5(key).hexdigest()
+        return [int(digest[i * 8:(i + 1) * 8], 16) % self.width
+                for i in range(self.depth)]
+
+    def increment(self, key):
+        """
+        Records an occurrence of the key
+        :param key: str, the key
+        :return: None
+        """
+        for row, i in zip(self._table, self._indexes(key)):
+            if row[i] < self._max_count:
+                row[i] += 1
+
+        self._additions += 1
+        if self._additions >= self.sample_size:
+            self.reset()
+
+    def estimate(self, key):
+        """
+        Returns the estimated frequency of the key
+        :param key: str, the key
+        :return: int
+        """
+        return min(row[i] for row, i in zip(self._table, self._indexes(key)))
+
+    def reset(self):
+        """Halves all counters, the aging step of TinyLFU"""
+        for row in self._table:
+            for i in range(self.width):
+                row[i] >>= 1
+        self._additions //= 2
+
+
+class SizeAwareAdmissionPolicy(object):
+    """
+        Decides whether a file is worth caching, given a byte budget.
+        Every access is recorded in a FrequencySketch and the files admitted
+        are kept in a registry with their sizes, until they are deleted or
+        expire. Files that memcached evicted on its own should be removed by
+        the caller once they are found missing. When a new file does not fit
+        in the budget, the least frequently used files that would have to be
+        evicted to make room are chosen as victims, and the file is admitted
+        only if it is seen more often than all of them together. This way a
+        one-off large file cannot push out many small hot ones.
+        Decisions are reported through `counters`.
+    """
+
+    def __init__(self, budget, sketch=None):
+        self.budget = budget
+        self.sketch = sketch or FrequencySketch()
+        self.registry = {}
+        self.expires_at = {}
+        self.used = 0
+        self.counters = Counter()
+        self._lock = threading.Lock()
+
+    def record_access(self, key):
+        """
+        Records a set or get of the key
+        :param key: str, the key
+        :return: None
+        """
+        with self._lock:
+            self.sketch.increment(key)
+
+    def admit(self, key, size):
+        """
+        Decides whether the file should be cached. The victims returned stay
+        in the registry, the caller should remove them from the cache, and
+        so from the registry, once the file has been stored.
+        :param key: str, the key of the file
+        :param size: int, the size of the file in bytes
+        :return: (boolean, list[str]), whether the file is admitted and the
+        keys of the files to evict to make room for it
+        """
+        with self._lock:
+            self._release_expired()
+            # the file's previous version, if any, makes room for the new one
+            needed = size - self.registry.get(key, 0) - \
+                (self.budget - self.used)
+            if size > self.budget:
+                self.counters["rejected"] += 1
+                return False, []
+            if needed <= 0:
+                self.counters["admitted"] += 1
+                return True, []
+
+            victims = []
+            victims_frequency = 0
+            freed = 0
+            for victim in sorted(
+                    (k for k in self.registry if k != key),
+                    key=lambda k: (self.sketch.estimate(k),
+                                   -self.registry[k])):
+                victims.append(victim)
+                victims_frequency += self.sketch.estimate(victim)
+                freed += self.registry[victim]
+                if freed >= needed:
+                    break
+
+            if self.sketch.estimate(key) <= victims_frequency:
+                self.counters["rejected"] += 1
+                return False, []
+
+            self.counters["admitted"] += 1
+            self.counters["evicted"] += len(victims)
+            return True, victims
+
+    def add(self, key, size, expire=0):
+        """
+        Registers a file that was stored in the cache
+        :param key: str, the key of the file
+        :param size: int, the size of the file in bytes
+        :param expire: int, the expiration the file was stored with, as
+        given to memcached, defaults to 0 - no expiration
+        :return: None
+        """
+        with self._lock:
+            self.used += size - self.registry.get(key, 0)
+            self.registry[key] = size
+            if not expire:
+                self.expires_at.pop(key, None)
+            elif expire > MAX_RELATIVE_EXPIRE:
+                self.expires_at[key] = expire
+            else:
+                self.expires_at[key] = time.time() + expire
+
+    def remove(self, key):
+        """
+        Unregisters a file that was removed from the cache
+        :param key: str, the key of the file
+        :return: None
+        """
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        self.used -= self.registry.pop(key, 0)
+        self.expires_at.pop(key, None)
+
+    def _release_expired(self):
+        """Unregisters the files that memcached has expired by now"""
+        now = time.time()
+        for key in [k for k, t in self.expires_at.items() if t <= now]:
+            self._remove(key)
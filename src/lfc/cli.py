@@ -0,0 +1,348 @@
+"""
+Command line interface for the large file cache, e.g.:
+
+    lfc warm ./data --jobs 8 --progress warm.progress
+    lfc stat somebigfile
+    lfc get somebigfile -o somebigfile.out
+    lfc bench --size 10485760 --iterations 10
+
+All the commands run on LargeFileMemcacheClient.
+"""
+from __future__ import print_function
+
+import argparse
+import glob
+import io
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from multiprocessing.pool import ThreadPool
+
+from client import LargeFileCacheClientFactory
+from config import MEMCACHED_HOST, MEMCACHED_PORT, MAX_RELATIVE_EXPIRE
+
+logger = logging.getLogger(__name__)
+
+
+def get_client(args):
+    """
+    Returns a LargeFileMemcacheClient for the server given in the arguments
+    :param args: argparse.Namespace, the parsed command line arguments
+    :return: LargeFileMemcacheClient
+    """
+    return LargeFileCacheClientFactory()('memcached', (args.host, args.port))
+
+
+def positive_int(value):
+    """
+    argparse type for the arguments that must be a positive integer
+    :param value: str, the command line value
+    :return: int
+    """
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(
+            "{} is not a positive integer".format(value)
+        )
+    return number
+
+
+def find_files(path):
+    """
+    Yields (key, path) pairs for all the files under a directory, or for all
+    the files that match a glob pattern.
+    For a directory the key is the path relative to it, otherwise the
+    matched path itself.
+    :param path: str, a directory or a glob pattern
+    :return: generator of (str, str) tuples
+    """
+    if os.path.isdir(path):
+        for root, _, names in os.walk(path):
+            for name in sorted(names):
+                full_path = os.path.join(root, name)
+                yield os.path.relpath(full_path, path), full_path
+    else:
+        for full_path in sorted(glob.glob(path)):
+            if os.path.isfile(full_path):
+                yield full_path, full_path
+
+
+def read_progress(progress_path):
+    """
+    Reads the keys that have already been warmed up in a previous run
+    :param progress_path: str, the progress file, can be None
+    :return: set[str], the keys already stored
+    """
+    if not progress_path or not os.path.exists(progress_path):
+        return set()
+    with open(progress_path) as progress:
+        return set(line.rstrip('\n') for line in progress if line.strip())
+
+
+def format_ttl(file_info):
+    """
+    Returns a human readable description of the time to live of a file,
+    based on the expiration stored in its file info
+    :param file_info: dict, the file info
+    :return: str
+    """
+    expire = file_info.get("expire")
+    if expire is None or "created" not in file_info:
+        return "unknown"
+    if not expire:
+        return "no expiration"
+    if expire > MAX_RELATIVE_EXPIRE:
+        expires_at = expire
+    else:
+        expires_at = file_info["created"] + expire
+    return "{}s remaining (expire={})".format(
+        max(0, int(expires_at - time.time())), expire
+    )
+
+
+def warm(args):
+    """
+    Loads all the files of a directory or a glob pattern in parallel.
+    Every stored key is appended to the progress file, if one is given, so
+    that an interrupted run can be resumed and skip what is already done.
+    """
+    done = read_progress(args.progress)
+    # the progress file may live in the directory being warmed up
+    progress_path = os.path.abspath(args.progress) if args.progress else None
+    todo = [(key, path) for key, path in find_files(args.path)
+            if args.prefix + key not in done and
+            os.path.abspath(path) != progress_path]
+
+    if not todo:
+        print("Nothing to warm up, {} files already done".format(len(done)))
+        return 0
+
+    local = threading.local()
+    lock = threading.Lock()
+    progress = open(args.progress, 'a') if args.progress else None
+
+    def warm_one(item):
+        key, path = item
+        key = args.prefix + key
+        if not hasattr(local, 'client'):
+            # pymemcache clients are not thread safe, one per thread
+            local.client = get_client(args)
+        client = local.client
+
+        try:
+            with open(path, 'rb') as f:
+                if client.get_file_info(key):
+                    if not args.force:
+                        logger.info("{} already cached, skipping".format(key))
+                        success = True
+                    else:
+                        success = client.sync(key, f, expire=args.expire)
+                else:
+                    success = client.set(key, f, expire=args.expire)
+        except Exception as e:
+            logger.error("Could not warm up {}: {}".format(key, e))
+            success = False
+
+        if success and progress:
+            with lock:
+                progress.write(key + '\n')
+                progress.flush()
+        return key, success
+
+    pool = ThreadPool(args.jobs)
+    failed = []
+    try:
+        for i, (key, success) in enumerate(
+                pool.imap_unordered(warm_one, todo), 1):
+            if not success:
+                failed.append(key)
+            print("[{}/{}] {} {}".format(
+                i, len(todo), key, "ok" if success else "FAILED"
+            ))
+    finally:
+        pool.close()
+        pool.join()
+        if progress:
+            progress.close()
+
+    print("Warmed up {} files, {} failed".format(
+        len(todo) - len(failed), len(failed)
+    ))
+    return 1 if failed else 0
+
+
+def stat(args):
+    """
+    Shows the file info of a key: size, parts, checksum, ttl and the parts
+    that are missing from the cache. Finding the missing parts reads all of
+    them from the server.
+    """
+    client = get_client(args)
+    file_info = client.get_file_info(args.key)
+    if not file_info:
+        print("File for key {} not found".format(args.key), file=sys.stderr)
+        return 1
+
+    missing = client.get_missing_parts(args.key, file_info)
+    print("key:       {}".format(args.key))
+    print("size:      {}".format(file_info.get("size", "unknown")))
+    print("parts:     {}".format(file_info["parts_num"]))
+    print("checksum:  {}".format(file_info["checksum"]))
+    print("ttl:       {}".format(format_ttl(file_info)))
+    print("manifest:  {}".format(
+        "binary v{}".format(file_info["version"])
+        if "version" in file_info else "json"
+    ))
+    print("missing:   {}".format(
+        ", ".join(str(i) for i in missing) if missing else "none"
+    ))
+    return 1 if missing else 0
+
+
+def get(args):
+    """
+    Streams the file of a key to stdout or to an output file
+    """
+    client = get_client(args)
+    if not client.get_file_info(args.key):
+        print("File for key {} not found".format(args.key), file=sys.stderr)
+        return 1
+
+    if args.output:
+        out = open(args.output, 'wb')
+    else:
+        out = getattr(sys.stdout, 'buffer', sys.stdout)
+
+    try:
+        for part in client.get_partial(args.key):
+            out.write(part)
+    except IOError as e:
+        print("Could not retrieve {}: {}".format(args.key, e),
+              file=sys.stderr)
+        if args.output:
+            out.close()
+            os.remove(args.output)
+        return 1
+
+    if args.output:
+        out.close()
+    else:
+        out.flush()
+    return 0
+
+
+def bench(args):
+    """
+    Measures the set, get and delete throughput against the given server
+    with a random payload
+    """
+    client = get_client(args)
+    payload = os.urandom(args.size)
+    mb = args.size / (1024.0 * 1024.0)
+    timings = {"set": [], "get": [], "delete": []}
+
+    for i in range(args.iterations):
+        key = "lfc_bench_{}_{}".format(uuid.uuid4().hex, i)
+
+        start = time.time()
+        if not client.set(key, io.BytesIO(payload)):
+            print("Could not set {}".format(key), file=sys.stderr)
+            client.purge(key)
+            return 1
+        timings["set"].append(time.time() - start)
+
+        start = time.time()
+        try:
+            data = client.get(key)
+        except IOError:
+            data = None
+        timings["get"].append(time.time() - start)
+        if not data or b"".join(data) != payload:
+            print("Could not get {} back".format(key), file=sys.stderr)
+            client.purge(key)
+            return 1
+
+        start = time.time()
+        client.delete(key)
+        timings["delete"].append(time.time() - start)
+
+    print("{} iterations of {} bytes against {}:{}".format(
+        args.iterations, args.size, args.host, args.port
+    ))
+    for op in ("set", "get", "delete"):
+        total = sum(timings[op])
+        print("{:<7} avg {:8.2f}ms  {:8.2f}MB/s".format(
+            op,
+            1000.0 * total / args.iterations,
+            mb * args.iterations / total if total else float('inf')
+        ))
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='lfc',
+        description='Warm up, inspect and benchmark the large file cache'
+    )
+    parser.add_argument('--host', default=MEMCACHED_HOST)
+    parser.add_argument('--port', type=int, default=MEMCACHED_PORT)
+    parser.add_argument('-v', '--verbose', action='store_true')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    warm_parser = subparsers.add_parser(
+        'warm', help='load a directory or a glob pattern in parallel'
+    )
+    warm_parser.add_argument('path', help='a directory or a glob pattern')
+    warm_parser.add_argument('-j', '--jobs', type=positive_int, default=4)
+    warm_parser.add_argument('--progress',
+                             help='file to record progress in, so that '
+                                  'an interrupted run can be resumed')
+    warm_parser.add_argument('--prefix', default='',
+                             help='prefix to prepend to every key')
+    warm_parser.add_argument('--expire', type=int, default=0)
+    warm_parser.add_argument('--force', action='store_true',
+                             help='update files that are already cached, '
+                                  'writing only the parts that changed')
+    warm_parser.set_defaults(func=warm)
+
+    stat_parser = subparsers.add_parser(
+        'stat', help="show a key's file info and missing parts, "
+                     "which reads all of the file's parts from the server"
+    )
+    stat_parser.add_argument('key')
+    stat_parser.set_defaults(func=stat)
+
+    get_cmd_parser = subparsers.add_parser(
+        'get', help='stream a file to stdout or to an output file'
+    )
+    get_cmd_parser.add_argument('key')
+    get_cmd_parser.add_argument('-o', '--output')
+    get_cmd_parser.set_defaults(func=get)
+
+    bench_parser = subparsers.add_parser(
+        'bench', help='run throughput tests against the server'
+    )
+    bench_parser.add_argument('--size', type=positive_int,
+                              default=10 * 1024 * 1024,
+                              help='payload size in bytes')
+    bench_parser.add_argument('-n', '--iterations', type=positive_int,
+                              default=5)
+    bench_parser.set_defaults(func=bench)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING
+    )
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
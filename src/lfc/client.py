@@ -1,9 +1,13 @@
 import json
 import logging
 import sys
+import time
 import hashlib
 from pymemcache.client import Client
 from config import MAX_FILE_SIZE, MAX_CHUNK
+from manifest import encode_manifest, decode_manifest, is_manifest, \
+    MIN_EXPIRE, MAX_EXPIRE
+from admission import AdmissionRejectedError
 
 from pymemcache.exceptions import MemcacheIllegalInputError
 
@@ -26,6 +30,8 @@ class LargeFileMemcacheClient(Client):
 
     _max_file_size = MAX_FILE_SIZE
     _max_chunk = MAX_CHUNK
+    # parts fetched at once when looking for missing ones
+    _parts_batch = 8
 
     def __init__(self, *args, **kwargs):
 
@@ -34,6 +40,9 @@ class LargeFileMemcacheClient(Client):
             self.raise_on_error = kwargs.get('raise_on_error', False)
             del kwargs['raise_on_error']
 
+        # optional, e.g. an lfc.admission.SizeAwareAdmissionPolicy
+        self.admission_policy = kwargs.pop('admission_policy', None)
+
         super(LargeFileMemcacheClient, self).__init__(*args, **kwargs)
 
         self.__use_base = False
@@ -111,6 +120,104 @@ class LargeFileMemcacheClient(Client):
         return self._max_chunk - (sys.getsizeof(key) +
                                   sys.getsizeof(self._max_post_fix))
 
+    def _admit(self, key, f):
+        """
+        Asks the admission policy, if any, whether the file should be cached
+        :param key: str, the name to store the file, usually the filename
+        :param f: file, the file object to store
+        :return: list[str], the keys of the files to evict once the file is
+        stored, None if the file should not be cached
+        """
+        if self.admission_policy is None:
+            return []
+
+        size = self.get_size(f)
+        self.admission_policy.record_access(key)
+        admitted, victims = self.admission_policy.admit(key, size)
+        if not admitted:
+            return None
+        return victims
+
+    def _reject(self, key):
+        """
+        Reports that a file was not admitted to the cache. Unlike other
+        failures it is not logged as an error, since it is expected.
+        :param key: str, the key of the file
+        :return: False, raises AdmissionRejectedError if `raise_on_error`
+        """
+        msg = "File {} was not admitted to the cache".format(key)
+        if self.raise_on_error:
+            raise AdmissionRejectedError(msg)
+        self.logger.info(msg)
+        return False
+
+    def _evict(self, key, victims):
+        """
+        Deletes the files the admission policy chose to evict to make room
+        for a file that has been stored
+        :param key: str, the key of the stored file
+        :param victims: list[str], the keys of the files to evict
+        :return: None
+        """
+        for victim in victims:
+            self.logger.info("Evicting {} to make room for {}".format(
+                victim, key))
+            # a victim already missing is unregistered by get_file_info
+            if self.get_file_info(victim):
+                self.delete(victim)
+
+    def get_file_info(self, key, default=None):
+        """
+        Returns the stored file info (manifest) for the given key, without
+        retrieving any of the file's parts.
+        Both binary manifests (see lfc.manifest) and the JSON file info
+        stored by earlier versions are supported.
+        :param key: str, The key to search in memcached, usually the filename
+        :param default: the value to return if the key is not found
+        :return: dict, the file info, e.g. {"checksum": ..., "parts_num": ...}
+        - False if it cannot be decoded, raises ValueError if `raise_on_error`
+        """
+        file_info = self._cache.get(key, default=default)
+        if not file_info and self.admission_policy is not None:
+            # expired or evicted by memcached, it no longer takes up space
+            self.admission_policy.remove(key)
+        if is_manifest(file_info):
+            try:
+                return decode_manifest(file_info)
+            except ValueError as e:
+                return self._raise_or_return(
+                    "Invalid file info for key {}: {}".format(key, e),
+                    ValueError
+                )
+        return file_info
+
+    def get_missing_parts(self, key, file_info=None):
+        """
+        Checks which of the file's parts are no longer in memcached, e.g.
+        because they have been evicted.
+        Memcached cannot check for a key without fetching its value, so the
+        parts are fetched in batches of `_parts_batch` and dropped as soon as
+        they are checked: this reads the whole file from memcached.
+        :param key: str, The key to search in memcached, usually the filename
+        :param file_info: dict, the file info if already retrieved
+        :return: list[int], the numbers of the missing parts, None if the
+        file was not found
+        """
+        file_info = file_info or self.get_file_info(key)
+        if not file_info:
+            return None
+
+        missing = []
+        parts_num = int(file_info["parts_num"])
+        for start in range(0, parts_num, self._parts_batch):
+            batch = range(start, min(start + self._parts_batch, parts_num))
+            found = set(self._cache.get_many(
+                [self.get_file_part_key(key, i) for i in batch]
+            ))
+            missing.extend(i for i in batch
+                           if self.get_file_part_key(key, i) not in found)
+        return missing
+
     def get(self, key, default=None):
         """
         Overrides default get functionality to provide chunk retrieval and
@@ -120,8 +227,11 @@ class LargeFileMemcacheClient(Client):
         :return: list: a single stream of bytes
         """
 
+        if self.admission_policy is not None:
+            self.admission_policy.record_access(key)
+
         # Get the file info first
-        file_info = self._cache.get(key, default=default)
+        file_info = self.get_file_info(key, default=default)
 
         if not file_info:  # file not found
             return self._raise_or_return(
@@ -141,6 +251,8 @@ class LargeFileMemcacheClient(Client):
                 self.get_file_part_key(key, i),
                 default=None
             )
+            if part is None:
+                raise IOError("Part {} of {} is missing".format(i, key))
             hash_md5.update(part)
             data.append(part)
         digest = hash_md5.hexdigest()
@@ -159,8 +271,11 @@ class LargeFileMemcacheClient(Client):
         :return: list: a single stream of bytes
         """
 
+        if self.admission_policy is not None:
+            self.admission_policy.record_access(key)
+
         # Get the file info first
-        file_info = self._cache.get(key, default=default)
+        file_info = self.get_file_info(key, default=default)
 
         if not file_info:  # file not found
             yield self._raise_or_return("File for key {} not found"
@@ -180,6 +295,8 @@ class LargeFileMemcacheClient(Client):
                 self.get_file_part_key(key, i),
                 default=None
             )
+            if part is None:
+                raise IOError("Part {} of {} is missing".format(i, key))
             hash_md5.update(part)
             data.append(part)
             yield part
@@ -197,33 +314,42 @@ class LargeFileMemcacheClient(Client):
         retrieved and restored properly.
         :param key: str, the name to store the file, usually the filename
         :param f: file, the file object to store
-        :param expire:
+        :param expire: int, the expiration of the file in seconds, defaults
+        to 0 - no expiration
         :param noreply:
-        :param store_chunk: boolean, flag to indicate whether to store a chunk
-        or proceed in chunking, defaults to False.
-        :return: boolean, True if everything went well, False otherwise
-        - raises exception if `raise_on_error`
+        :return: boolean, True if everything went well, False otherwise,
+        e.g. if the admission policy does not admit the file
+        - raises exception if `raise_on_error`, AdmissionRejectedError if
+        the file is not admitted
         """
 
         success = False
 
-        # check if size within limits
-        if not self.is_of_appropriate_size(f):
-            return self._raise_or_return("Size greater than allowed.")
-
-        # check if not duplicate key
-        if self._cache.get(key):
-            return self._raise_or_return("Key {} already exists.".format(key))
-
+        # storing a part through set_many: parts left over from a file that
+        # was not fully deleted, e.g. whose file info was evicted, must be
+        # overwritten rather than kept under the new checksum
         if self.__use_base:
             try:
-                return self._cache.set(key, f)
+                return self._cache.set(key, f, expire=expire, noreply=noreply)
             except MemcacheIllegalInputError as e:
                 return self._raise_or_return(
                     e.message,
                     MemcacheIllegalInputError
                 )
 
+        # check if size within limits
+        if not self.is_of_appropriate_size(f):
+            return self._raise_or_return("Size greater than allowed.")
+
+        if not MIN_EXPIRE <= expire <= MAX_EXPIRE:
+            return self._raise_or_return(
+                "Invalid expire {}.".format(expire), ValueError
+            )
+
+        # check if not duplicate key
+        if self._cache.get(key):
+            return self._raise_or_return("Key {} already exists.".format(key))
+
         # if not self.__use_base means we are not storing a chunk
         # so let's check if file and has read
         if not hasattr(f, 'read') and not hasattr(f, 'seek'):
@@ -232,8 +358,14 @@ class LargeFileMemcacheClient(Client):
 
         # check if file exists
         if not self._cache.get(key):
+            victims = self._admit(key, f)
+            if victims is None:
+                return self._reject(key)
+
             i = 0
+            size = 0
             parts_to_store = {}
+            digests = []
             hash_md5 = hashlib.md5()
 
             # the proper chunk will be found by removing the size of the
@@ -242,22 +374,36 @@ class LargeFileMemcacheClient(Client):
 
             for piece in iter(lambda: f.read(chunk), b""):
                 hash_md5.update(piece)
+                size += len(piece)
+                digests.append(hashlib.md5(piece).hexdigest())
                 parts_to_store.update({self.get_file_part_key(key, i): piece})
                 i += 1
 
-            # also store the hash for the reconstruction
-            parts_to_store[key] = {"checksum": hash_md5.hexdigest(),
-                                   "parts_num": i}
+            # also store the hash for the reconstruction, and the hash of
+            # each part so that sync can tell which parts changed
+            parts_to_store[key] = encode_manifest({
+                "checksum": hash_md5.hexdigest(),
+                "parts_num": i,
+                "size": size,
+                "chunk_size": chunk,
+                "digests": digests,
+                "expire": expire,
+                "created": int(time.time())
+            })
 
             self.__use_base = True
             try:
                 # save the hash to compare when retrieving
-                success = self._cache.set_many(parts_to_store)
+                success = self._cache.set_many(parts_to_store, expire=expire)
             except MemcacheIllegalInputError as e:
                 return self._raise_or_return(e, MemcacheIllegalInputError)
 
             self.__use_base = False
 
+            if success and self.admission_policy is not None:
+                self.admission_policy.add(key, size, expire)
+                self._evict(key, victims)
+
             if not success:
                 self.logger.error("Could not save part {} to memcached. "
                                   "Performing roll-back".format(i))
@@ -305,7 +451,7 @@ class LargeFileMemcacheClient(Client):
         if self.__use_base:
             return self._cache.delete(key)
 
-        file_info = self._cache.get(key)
+        file_info = self.get_file_info(key)
         if file_info:
             to_remove = []
             for i in range(int(file_info["parts_num"])):
@@ -315,14 +461,49 @@ class LargeFileMemcacheClient(Client):
             self.__use_base = True
             success = self._cache.delete_many(to_remove)
             self.__use_base = False
+            if self.admission_policy is not None:
+                self.admission_policy.remove(key)
             if not success:
                 return self._raise_or_return("Could not delete")
+        elif self._cache.get(key) is not None:
+            # the file info could not be decoded, so the parts cannot be
+            # found, but the key itself can still be removed
+            return self._cache.delete(key)
         else:
             return self._raise_or_return(
                 "Could not delete {}. File not found in cache".format(key))
 
         return success
 
+    def purge(self, key, parts_num=None):
+        """
+        Deletes a file's info and its parts, even if the file info is missing
+        or cannot be decoded, e.g. to clean up after a failed set or sync.
+        :param key: str, the key of the file
+        :param parts_num: int, the number of parts to delete, defaults to
+        the ones in the file info, or else to the most parts a file of
+        MAX_FILE_SIZE can have
+        :return: boolean, True if everything went ok, False otherwise
+        """
+        if parts_num is None:
+            try:
+                file_info = self.get_file_info(key)
+            except ValueError:
+                file_info = None
+            if file_info:
+                parts_num = int(file_info["parts_num"])
+            else:
+                parts_num = self._max_file_size // self.get_chunk_size(key) + 1
+
+        to_remove = [self.get_file_part_key(key, i) for i in range(parts_num)]
+        to_remove.append(key)
+        self.__use_base = True
+        success = self._cache.delete_many(to_remove)
+        self.__use_base = False
+        if self.admission_policy is not None:
+            self.admission_policy.remove(key)
+        return success
+
     def delete_many(self, keys, noreply=None):
         """
         Uses simple delete underneath to delete files and their data from
@@ -362,7 +543,139 @@ class LargeFileMemcacheClient(Client):
         :return: boolean, True if everything went ok, False otherwise
         """
         self.delete(key)
-        return self.set(key, f)
+        return self.set(key, f, expire=expire, noreply=noreply)
+
+    def _invalidate(self, key):
+        """
+        Deletes the file info of a file whose parts can no longer be trusted,
+        so that it reads as a miss instead of failing the checksum
+        :param key: str, the key of the file
+        :return: None
+        """
+        self._cache.delete(key)
+        if self.admission_policy is not None:
+            self.admission_policy.remove(key)
+
+    def sync(self, key, f, expire=0):
+        """
+        Updates a stored file, writing only the parts that changed.
+        The digest of each chunk of the new file is compared with the one in
+        the stored file info and only the changed or new parts are written.
+        Unchanged parts are touched so that they expire along with the file,
+        and parts left over from a longer previous version are deleted.
+        While parts are being written the file info is deleted so the file
+        reads as a miss, and if writing them fails the whole file is purged,
+        so that no stale parts are left behind.
+        Since the chunks are of fixed size, this pays off for files that are
+        appended to or changed in place, e.g. logs, but not for insertions.
+        If the file is not stored yet, or was stored without part digests,
+        it falls back to set / replace. If the admission policy rejects the
+        new version, the old one is deleted.
+        :param key: str, the name of the stored file, usually the filename
+        :param f: file, the new version of the file
+        :param expire: int, the expiration of the file in seconds, defaults
+        to 0 - no expiration
+        :return: boolean, True if everything went well, False otherwise
+        - raises exception if `raise_on_error`, AdmissionRejectedError if
+        the new version is not admitted
+        """
+        if not MIN_EXPIRE <= expire <= MAX_EXPIRE:
+            return self._raise_or_return(
+                "Invalid expire {}.".format(expire), ValueError
+            )
+
+        file_info = self.get_file_info(key)
+        if not file_info:
+            return self.set(key, f, expire=expire)
+
+        chunk = self.get_chunk_size(key)
+        if file_info.get("digests") is None or \
+                file_info.get("chunk_size") != chunk:
+            return self.replace(key, f, expire=expire)
+
+        if not self.is_of_appropriate_size(f):
+            return self._raise_or_return("Size greater than allowed.")
+
+        if not hasattr(f, 'read') and not hasattr(f, 'seek'):
+            return self._raise_or_return("{} is not a file.".format(key),
+                                         AttributeError)
+
+        victims = self._admit(key, f)
+        if victims is None:
+            # the old version must not be served as the current one
+            self.purge(key)
+            return self._reject(key)
+
+        old_digests = file_info["digests"]
+        old_parts_num = int(file_info["parts_num"])
+        invalidated = False
+        i = 0
+        size = 0
+        written = 0
+        digests = []
+        hash_md5 = hashlib.md5()
+
+        try:
+            for piece in iter(lambda: f.read(chunk), b""):
+                hash_md5.update(piece)
+                size += len(piece)
+                digest = hashlib.md5(piece).hexdigest()
+                digests.append(digest)
+                part_key = self.get_file_part_key(key, i)
+                # touch fails if the part has been evicted, so write it again
+                if i >= len(old_digests) or old_digests[i] != digest or \
+                        not self._cache.touch(part_key, expire,
+                                              noreply=False):
+                    if not invalidated:
+                        # the parts are overwritten in place, so until the
+                        # new file info is stored the file reads as a miss
+                        # rather than as a mix of old and new parts
+                        self._invalidate(key)
+                        invalidated = True
+                    if not self._cache.set(part_key, piece, expire=expire,
+                                           noreply=False):
+                        self.purge(key, max(old_parts_num, i + 1))
+                        return self._raise_or_return(
+                            "Could not save part {} of {}".format(i, key)
+                        )
+                    written += 1
+                i += 1
+
+            success = self._cache.set(key, encode_manifest({
+                "checksum": hash_md5.hexdigest(),
+                "parts_num": i,
+                "size": size,
+                "chunk_size": chunk,
+                "digests": digests,
+                "expire": expire,
+                "created": int(time.time())
+            }), expire=expire, noreply=False)
+        except MemcacheIllegalInputError as e:
+            self.purge(key, max(old_parts_num, i + 1))
+            return self._raise_or_return(e, MemcacheIllegalInputError)
+
+        if not success:
+            self.purge(key, max(old_parts_num, i + 1))
+            return self._raise_or_return(
+                "Could not save the file info of {}".format(key)
+            )
+
+        if self.admission_policy is not None:
+            self.admission_policy.add(key, size, expire)
+            self._evict(key, victims)
+
+        # trim the parts left over from the previous version
+        leftover = [self.get_file_part_key(key, j)
+                    for j in range(i, int(file_info["parts_num"]))]
+        if leftover:
+            self.__use_base = True
+            self._cache.delete_many(leftover)
+            self.__use_base = False
+
+        self.logger.info("Synced {}: wrote {} of {} parts, trimmed {}".format(
+            key, written, i, len(leftover)
+        ))
+        return True
 
     def __setitem__(self, key, value):
         self.set(key, value, noreply=True)
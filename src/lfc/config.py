@@ -2,3 +2,5 @@ MAX_CHUNK = 1024 * 1024
 MAX_FILE_SIZE = 50 * 1024 * 1024
 MEMCACHED_HOST = 'localhost'
 MEMCACHED_PORT = 11211
+# memcached treats expiration times larger than 30 days as unix timestamps
+MAX_RELATIVE_EXPIRE = 60 * 60 * 24 * 30
@@ -0,0 +1,102 @@
+"""
+Compact binary format for the file info (manifest) stored under a file's key.
+
+    magic       4s   b"LFCM"
+    version     B    MANIFEST_VERSION
+    codec       B    how the parts are encoded, CODEC_NONE for raw bytes
+    size        Q    total length of the file in bytes
+    chunk_size  I    the size of each part in bytes
+    parts_num   I    the number of parts
+    expire      i    the expiration the file was stored with, memcached
+                     accepts negative ones
+    created     I    unix timestamp of when the file was stored
+    checksum    16s  md5 digest of the whole file
+    digests     16s  md5 digest of each part, parts_num times
+
+All the fields are big-endian, so a manifest is 46 bytes plus 16 bytes per
+part, and a single small memcached item even for thousands of parts.
+"""
+import binascii
+import struct
+
+MANIFEST_MAGIC = b"LFCM"
+MANIFEST_VERSION = 1
+CODEC_NONE = 0
+MIN_EXPIRE = -2 ** 31
+MAX_EXPIRE = 2 ** 31 - 1
+
+_header = struct.Struct(">4sBBQIIiI16s")
+_digest_size = 16
+
+
+def is_manifest(data):
+    """
+    Checks if the data is an encoded manifest
+    :param data: bytes, the value stored under a file's key
+    :return: boolean
+    """
+    return isinstance(data, bytes) and data[:4] == MANIFEST_MAGIC
+
+
+def encode_manifest(file_info):
+    """
+    Encodes the file info to the binary manifest format
+    :param file_info: dict, with the checksum, parts_num, size, chunk_size,
+    digests, expire, created and, optionally, codec of the file
+    :return: bytes
+    - raises ValueError if a field does not fit in the format
+    """
+    digests = file_info["digests"]
+    assert len(digests) == file_info["parts_num"], \
+        "Expected {} digests, got {}.".format(file_info["parts_num"],
+                                              len(digests))
+    try:
+        header = _header.pack(
+            MANIFEST_MAGIC,
+            MANIFEST_VERSION,
+            file_info.get("codec", CODEC_NONE),
+            file_info["size"],
+            file_info["chunk_size"],
+            file_info["parts_num"],
+            file_info["expire"],
+            file_info["created"],
+            binascii.unhexlify(file_info["checksum"])
+        )
+    except struct.error as e:
+        raise ValueError(str(e))
+    return header + binascii.unhexlify("".join(digests))
+
+
+def decode_manifest(data):
+    """
+    Decodes a binary manifest to the file info
+    :param data: bytes, the encoded manifest
+    :return: dict, the file info
+    """
+    if not is_manifest(data):
+        raise ValueError("Not a manifest.")
+    if len(data) < _header.size:
+        raise ValueError("Truncated manifest.")
+
+    (_, version, codec, size, chunk_size, parts_num,
+     expire, created, checksum) = _header.unpack_from(data)
+    if version != MANIFEST_VERSION:
+        raise ValueError("Unsupported manifest version {}.".format(version))
+
+    end = _header.size + parts_num * _digest_size
+    if len(data) < end:
+        raise ValueError("Truncated manifest.")
+
+    # one hexlify call for all the digests is much faster than one per part
+    digests = binascii.hexlify(data[_header.size:end]).decode('ascii')
+    width = 2 * _digest_size
+    return {"version": version,
+            "codec": codec,
+            "size": size,
+            "chunk_size": chunk_size,
+            "parts_num": parts_num,
+            "expire": expire,
+            "created": created,
+            "checksum": binascii.hexlify(checksum).decode('ascii'),
+            "digests": [digests[i:i + width]
+                        for i in range(0, len(digests), width)]}
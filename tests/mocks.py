@@ -6,19 +6,25 @@ class MockCache(object):
         super(MockCache, self).__init__()
         self._cache = {}
 
-    def set(self, k, v):
+    def set(self, k, v, expire=0, noreply=None):
         self._cache[k] = v
         return True
 
     def get(self, k, default=None):
         return self._cache.get(k, default)
 
+    def get_many(self, keys):
+        return dict((k, self._cache[k]) for k in keys if k in self._cache)
+
+    def touch(self, k, expire=0, noreply=None):
+        return k in self._cache
+
     def delete(self, k):
         if k in self._cache:
             del self._cache[k]
         return True
 
-    def set_many(self, items):
+    def set_many(self, items, expire=0, noreply=None):
         for k, v in items.iteritems():
             self.set(k, v)
         return True
@@ -27,3 +33,50 @@ class MockCache(object):
         for k in items:
             self.delete(k)
         return True
+
+
+class MockMemcacheServer(object):
+    """
+    Simple memcached to use for mocking pymemcache's low level commands, so
+    that the Client's own set_many / get_many / delete_many, which dispatch
+    to the overridden set / delete, are exercised
+    """
+    def __init__(self):
+        super(MockMemcacheServer, self).__init__()
+        self._cache = {}
+        self.client = None
+        # keys whose set will fail, like a full memcached would do
+        self.fail_keys = set()
+
+    def install(self, client):
+        self.client = client
+        client._store_cmd = self._store_cmd
+        client._fetch_cmd = self._fetch_cmd
+        client._misc_cmd = self._misc_cmd
+        return client
+
+    def _store_cmd(self, name, key, expire, noreply, data, cas=None):
+        key = self.client.check_key(key)
+        if key in self.fail_keys:
+            return False
+        self._cache[key] = self.client.serializer(key, data)
+        return True
+
+    def _fetch_cmd(self, name, keys, expect_cas):
+        result = {}
+        for k in keys:
+            checked_key = self.client.check_key(k)
+            if checked_key in self._cache:
+                data, flags = self._cache[checked_key]
+                result[k] = self.client.deserializer(k, data, flags)
+        return result
+
+    def _misc_cmd(self, cmd, cmd_name, noreply):
+        key = cmd.split()[1]
+        if cmd_name == b'delete':
+            line = b'DELETED' if self._cache.pop(key, None) else b'NOT_FOUND'
+        elif cmd_name == b'touch':
+            line = b'TOUCHED' if key in self._cache else b'NOT_FOUND'
+        else:
+            raise NotImplementedError(cmd_name)
+        return None if noreply else line
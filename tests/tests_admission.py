@@ -0,0 +1,122 @@
+import time
+import unittest
+
+import mock as mock
+
+from lfc.admission import FrequencySketch, SizeAwareAdmissionPolicy
+
+
+class TestFrequencySketch(unittest.TestCase):
+    """
+    Tests for the TinyLFU-style frequency sketch
+    """
+
+    def test_estimate(self):
+        sketch = FrequencySketch()
+        for _ in range(3):
+            sketch.increment('hot')
+        sketch.increment('cold')
+
+        self.assertEqual(sketch.estimate('hot'), 3)
+        self.assertEqual(sketch.estimate('cold'), 1)
+        self.assertEqual(sketch.estimate('unseen'), 0)
+
+    def test_counters_saturate(self):
+        sketch = FrequencySketch()
+        for _ in range(100):
+            sketch.increment('hot')
+        self.assertEqual(sketch.estimate('hot'), FrequencySketch._max_count)
+
+    def test_reset_halves_counters(self):
+        sketch = FrequencySketch(width=64, sample_size=8)
+        for _ in range(7):
+            sketch.increment('hot')
+        self.assertEqual(sketch.estimate('hot'), 7)
+        sketch.increment('hot')
+        self.assertEqual(sketch.estimate('hot'), 4)
+
+
+class TestSizeAwareAdmissionPolicy(unittest.TestCase):
+    """
+    Tests for the size aware admission policy
+    """
+
+    def setUp(self):
+        self.policy = SizeAwareAdmissionPolicy(budget=100)
+
+    def access(self, key, times=1):
+        for _ in range(times):
+            self.policy.record_access(key)
+
+    def test_admit_within_budget(self):
+        self.access('a')
+        self.assertEqual(self.policy.admit('a', 60), (True, []))
+        self.policy.add('a', 60)
+        self.assertEqual(self.policy.used, 60)
+        self.assertEqual(self.policy.counters['admitted'], 1)
+
+    def test_reject_larger_than_budget(self):
+        self.access('a', 10)
+        self.assertEqual(self.policy.admit('a', 101), (False, []))
+        self.assertEqual(self.policy.counters['rejected'], 1)
+
+    def test_reject_one_off_large_file(self):
+        """
+        A file seen once does not evict files that are accessed often
+        """
+        for key in ('a', 'b', 'c'):
+            self.access(key, 3)
+            self.policy.admit(key, 30)
+            self.policy.add(key, 30)
+
+        self.access('large')
+        self.assertEqual(self.policy.admit('large', 50), (False, []))
+        self.assertEqual(self.policy.used, 90)
+        self.assertEqual(self.policy.counters['rejected'], 1)
+
+    def test_admit_frequent_file_evicting_victims(self):
+        """
+        A file accessed more often than the least used files evicts them
+        """
+        self.access('a', 5)
+        self.access('b', 1)
+        for key in ('a', 'b'):
+            self.policy.admit(key, 40)
+            self.policy.add(key, 40)
+
+        self.access('c', 3)
+        self.assertEqual(self.policy.admit('c', 40), (True, ['b']))
+        # the victims stay registered until they are removed from the cache
+        self.assertEqual(sorted(self.policy.registry), ['a', 'b'])
+        self.policy.add('c', 40)
+        self.policy.remove('b')
+        self.assertEqual(sorted(self.policy.registry), ['a', 'c'])
+        self.assertEqual(self.policy.used, 80)
+        self.assertEqual(self.policy.counters['evicted'], 1)
+
+    def test_expired_files_are_released(self):
+        """
+        Files stored with an expiration stop counting against the budget
+        once they have expired
+        """
+        self.access('a', 5)
+        self.policy.add('a', 80, expire=60)
+        self.access('b')
+        self.assertEqual(self.policy.admit('b', 50), (False, []))
+
+        with mock.patch('lfc.admission.time.time',
+                        return_value=time.time() + 61):
+            self.assertEqual(self.policy.admit('b', 50), (True, []))
+        self.assertEqual(self.policy.registry, {})
+        self.assertEqual(self.policy.used, 0)
+
+    def test_remove(self):
+        self.policy.add('a', 40)
+        self.policy.remove('a')
+        self.policy.remove('a')
+        self.assertEqual(self.policy.used, 0)
+        self.assertEqual(self.policy.registry, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import mock as mock
+from mocks import MockCache
+from lfc import cli
+from lfc.client import LargeFileCacheClientFactory, LargeFileMemcacheClient
+from lfc.config import MEMCACHED_HOST, MEMCACHED_PORT
+
+
+class TestCli(unittest.TestCase):
+    """
+    Tests for the lfc command line interface
+    """
+
+    def setUp(self):
+        self.patcher = mock.patch('pymemcache.client.Client')
+        self.mock_client = self.patcher.start()
+        self.temp_dir = tempfile.mkdtemp()
+        for name, size in (('a.dat', 1024), ('b.dat', 3 * 1024 * 1024)):
+            with open(os.path.join(self.temp_dir, name), 'wb') as out:
+                out.truncate(size)
+
+        # all the clients created by the cli share the same mock cache
+        self.cache = MockCache()
+        self.client_patcher = mock.patch.object(cli, 'get_client',
+                                                side_effect=self.get_client)
+        self.client_patcher.start()
+
+    def tearDown(self):
+        self.client_patcher.stop()
+        self.patcher.stop()
+        shutil.rmtree(self.temp_dir)
+
+    def get_client(self, args):
+        client = LargeFileCacheClientFactory()('memcached',
+                                               (MEMCACHED_HOST,
+                                                MEMCACHED_PORT))
+        client._cache = self.cache
+        return client
+
+    def test_find_files(self):
+        """
+        Directories are walked and keyed by relative path, globs by the
+        matched path
+        :return: None
+        """
+        self.assertEqual(
+            [key for key, _ in cli.find_files(self.temp_dir)],
+            ['a.dat', 'b.dat']
+        )
+        pattern = os.path.join(self.temp_dir, 'a*')
+        self.assertEqual(list(cli.find_files(pattern)),
+                         [(os.path.join(self.temp_dir, 'a.dat'),
+                           os.path.join(self.temp_dir, 'a.dat'))])
+
+    def test_warm_resumes_from_progress(self):
+        """
+        Files recorded in the progress file are not stored again
+        :return: None
+        """
+        progress = os.path.join(self.temp_dir, 'warm.progress')
+        with open(progress, 'w') as out:
+            out.write('a.dat\n')
+
+        self.assertEqual(cli.main(['warm', self.temp_dir, '-j', '2',
+                                   '--progress', progress]), 0)
+        self.assertIsNone(self.cache.get('a.dat'))
+        self.assertEqual(cli.get_client(None).get_file_info('b.dat')['size'],
+                         3 * 1024 * 1024)
+        self.assertEqual(cli.read_progress(progress), {'a.dat', 'b.dat'})
+
+    def test_stat_reports_missing_parts(self):
+        """
+        stat fails when parts of the file have been evicted
+        :return: None
+        """
+        self.assertEqual(cli.main(['warm', self.temp_dir]), 0)
+        self.assertEqual(cli.main(['stat', 'b.dat']), 0)
+        self.cache.delete('b.dat_1')
+        self.assertEqual(cli.main(['stat', 'b.dat']), 1)
+        self.assertEqual(cli.main(['stat', 'c.dat']), 1)
+
+    def test_get_to_file(self):
+        """
+        get writes the file to the output path
+        :return: None
+        """
+        import filecmp
+        self.assertEqual(cli.main(['warm', self.temp_dir]), 0)
+        output = os.path.join(self.temp_dir, 'out.dat')
+        self.assertEqual(cli.main(['get', 'b.dat', '-o', output]), 0)
+        self.assertTrue(filecmp.cmp(output,
+                                    os.path.join(self.temp_dir, 'b.dat')))
+
+    def test_bench(self):
+        """
+        bench stores, retrieves and deletes the payload, and fails if it
+        does not get it back
+        :return: None
+        """
+        self.assertEqual(cli.main(['bench', '--size', '4096', '-n', '2']), 0)
+        self.assertEqual(self.cache._cache, {})
+
+        with mock.patch.object(LargeFileMemcacheClient, 'get',
+                               return_value=False):
+            self.assertEqual(cli.main(['bench', '--size', '4096']), 1)
+        self.assertEqual(self.cache._cache, {})
+
+    def test_positive_arguments(self):
+        """
+        The number of jobs and iterations must be positive
+        :return: None
+        """
+        for argv in (['warm', self.temp_dir, '-j', '0'],
+                     ['bench', '-n', '0'],
+                     ['bench', '--size', '-1']):
+            with self.assertRaises(SystemExit):
+                cli.main(argv)
+
+    def test_format_ttl(self):
+        self.assertEqual(cli.format_ttl({}), 'unknown')
+        self.assertEqual(cli.format_ttl({'expire': 0, 'created': 1}),
+                         'no expiration')
+        self.assertTrue(cli.format_ttl(
+            {'expire': 60, 'created': int(time.time())}
+        ).endswith('remaining (expire=60)'))
+
+
+if __name__ == '__main__':
+    unittest.main()
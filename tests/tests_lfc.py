@@ -2,7 +2,8 @@ import os
 import unittest
 
 import mock as mock
-from mocks import MockCache
+from mocks import MockCache, MockMemcacheServer
+from lfc.admission import SizeAwareAdmissionPolicy, AdmissionRejectedError
 from lfc.client import LargeFileCacheClientFactory, LargeFileMemcacheClient
 from lfc.config import MEMCACHED_HOST, MEMCACHED_PORT, MAX_FILE_SIZE, MAX_CHUNK
 
@@ -221,6 +222,319 @@ class TestLargeFileMemcachedClient(unittest.TestCase):
         self.assertTrue('File for key bigoldfile.dat_not_valid not found'
                         in context.exception)
 
+    def test_get_file_info(self):
+        """
+        The file info holds the checksum, the number of parts, the size and
+        the expiration of the stored file
+        :return: None
+        """
+        success = self.lfc.set(self.large_file_path, self.large_file,
+                               expire=3600)
+        self.assertTrue(success)
+
+        file_info = self.lfc.get_file_info(self.large_file_path)
+        self.assertEqual(file_info["size"], MAX_FILE_SIZE)
+        self.assertEqual(file_info["expire"], 3600)
+        self.assertGreater(file_info["parts_num"], 0)
+        self.assertIsNone(self.lfc.get_file_info(self.larger_file_path))
+
+    def test_get_missing_parts(self):
+        """
+        Evicted parts are reported as missing and make get fail
+        :return: None
+        """
+        success = self.lfc.set(self.large_file_path, self.large_file)
+        self.assertTrue(success)
+        self.assertEqual(self.lfc.get_missing_parts(self.large_file_path), [])
+
+        self.lfc._cache.delete(self.lfc.get_file_part_key(
+            self.large_file_path, 2
+        ))
+        self.assertEqual(self.lfc.get_missing_parts(self.large_file_path),
+                         [2])
+        self.assertIsNone(self.lfc.get_missing_parts(self.larger_file_path))
+
+        with self.assertRaises(IOError):
+            self.lfc.get(self.large_file_path)
+
+    def test_admission_policy(self):
+        """
+        A file that does not fit in the budget is rejected, while frequently
+        accessed files evict the least used ones
+        :return: None
+        """
+        policy = SizeAwareAdmissionPolicy(budget=MAX_FILE_SIZE)
+        self.lfc.admission_policy = policy
+
+        success = self.lfc.set(self.large_file_path, self.large_file)
+        self.assertTrue(success)
+        self.assertEqual(policy.registry,
+                         {self.large_file_path: MAX_FILE_SIZE})
+
+        # one-off file, does not evict the cached one
+        self.large_file.seek(0)
+        self.assertFalse(self.lfc.set('another', self.large_file))
+        self.assertEqual(policy.counters["rejected"], 1)
+
+        # popular file, evicts the cached one
+        for _ in range(3):
+            self.lfc.get('popular')
+        self.large_file.seek(0)
+        self.assertTrue(self.lfc.set('popular', self.large_file))
+        self.assertIsNone(self.lfc.get_file_info(self.large_file_path))
+        self.assertEqual(policy.counters["evicted"], 1)
+
+        # rejections follow raise_on_error
+        self.lfc.raise_on_error = True
+        self.large_file.seek(0)
+        with self.assertRaises(AdmissionRejectedError):
+            self.lfc.set('another', self.large_file)
+        self.lfc.raise_on_error = False
+
+        self.lfc.delete('popular')
+        self.assertEqual(policy.used, 0)
+
+    def test_sync_writes_only_changed_parts(self):
+        """
+        sync writes only the changed and new parts and trims the leftovers
+        :return: None
+        """
+        import io
+        chunk = self.lfc.get_chunk_size(self.large_file_path)
+        data = b"a" * chunk * 3
+        success = self.lfc.set(self.large_file_path, io.BytesIO(data))
+        self.assertTrue(success)
+
+        self.lfc._cache.set = mock.MagicMock(side_effect=self.lfc._cache.set)
+        # change the second part and append a fourth one
+        changed = b"a" * chunk + b"b" * chunk + b"a" * chunk + b"c"
+        success = self.lfc.sync(self.large_file_path, io.BytesIO(changed))
+        self.assertTrue(success)
+        written = [c[0][0] for c in self.lfc._cache.set.call_args_list]
+        self.assertEqual(written, [
+            self.lfc.get_file_part_key(self.large_file_path, 1),
+            self.lfc.get_file_part_key(self.large_file_path, 3),
+            self.large_file_path
+        ])
+        self.assertEqual(b"".join(self.lfc.get(self.large_file_path)),
+                         changed)
+
+        # shrink the file, the leftover parts are deleted
+        success = self.lfc.sync(self.large_file_path, io.BytesIO(b"a"))
+        self.assertTrue(success)
+        self.assertEqual(self.lfc.get(self.large_file_path), [b"a"])
+        self.assertIsNone(self.lfc._cache.get(
+            self.lfc.get_file_part_key(self.large_file_path, 1)))
+
+    def test_sync_failure_invalidates_file(self):
+        """
+        If a part cannot be written, the file reads as a miss instead of a
+        mix of old and new parts
+        :return: None
+        """
+        import io
+        chunk = self.lfc.get_chunk_size(self.large_file_path)
+        success = self.lfc.set(self.large_file_path,
+                               io.BytesIO(b"a" * chunk * 3))
+        self.assertTrue(success)
+
+        set_ = self.lfc._cache.set
+        failing_part = self.lfc.get_file_part_key(self.large_file_path, 2)
+        self.lfc._cache.set = mock.MagicMock(
+            side_effect=lambda k, v, **kwargs:
+            k != failing_part and set_(k, v, **kwargs)
+        )
+        changed = b"b" * chunk * 3
+        success = self.lfc.sync(self.large_file_path, io.BytesIO(changed))
+        self.assertFalse(success)
+        self.assertIsNone(self.lfc.get_file_info(self.large_file_path))
+        self.assertFalse(self.lfc.get(self.large_file_path))
+
+    def test_sync_failure_leaves_no_stale_parts(self):
+        """
+        After a failed sync, storing the file again through pymemcache's own
+        set_many does not keep any of the stale parts
+        :return: None
+        """
+        import io
+        self.lfc._cache = super(LargeFileMemcacheClient, self.lfc)
+        server = MockMemcacheServer()
+        server.install(self.lfc)
+
+        chunk = self.lfc.get_chunk_size(self.large_file_path)
+        self.assertTrue(self.lfc.set(self.large_file_path,
+                                     io.BytesIO(b"a" * chunk * 4)))
+
+        changed = b"b" * chunk * 4
+        server.fail_keys.add(self.lfc.check_key(
+            self.lfc.get_file_part_key(self.large_file_path, 2)
+        ))
+        self.assertFalse(self.lfc.sync(self.large_file_path,
+                                       io.BytesIO(changed)))
+        self.assertEqual(server._cache, {})
+        self.assertFalse(self.lfc.get(self.large_file_path))
+
+        server.fail_keys.clear()
+        new = b"c" * chunk * 4
+        self.assertTrue(self.lfc.set(self.large_file_path, io.BytesIO(new)))
+        self.assertEqual(b"".join(self.lfc.get(self.large_file_path)), new)
+
+    def test_set_overwrites_leftover_parts(self):
+        """
+        Parts left over from a file whose file info was evicted are
+        overwritten, not kept under the new checksum
+        :return: None
+        """
+        import io
+        self.lfc._cache = super(LargeFileMemcacheClient, self.lfc)
+        MockMemcacheServer().install(self.lfc)
+
+        chunk = self.lfc.get_chunk_size(self.large_file_path)
+        self.assertTrue(self.lfc.set(self.large_file_path,
+                                     io.BytesIO(b"a" * chunk * 2)))
+        self.lfc._cache.delete(self.large_file_path)
+
+        new = b"b" * chunk * 2
+        self.assertTrue(self.lfc.set(self.large_file_path, io.BytesIO(new)))
+        self.assertEqual(b"".join(self.lfc.get(self.large_file_path)), new)
+
+    def test_sync_rejected_deletes_old_version(self):
+        """
+        When the admission policy rejects the new version of a file, the old
+        one is deleted instead of being served as current
+        :return: None
+        """
+        import io
+        policy = SizeAwareAdmissionPolicy(budget=1000)
+        self.lfc.admission_policy = policy
+        self.assertTrue(self.lfc.set('hot', io.BytesIO(b"h" * 600)))
+        for _ in range(5):
+            self.lfc.get('hot')
+        self.assertTrue(self.lfc.set('k', io.BytesIO(b"k" * 300)))
+
+        self.assertFalse(self.lfc.sync('k', io.BytesIO(b"n" * 500)))
+        self.assertFalse(self.lfc.get('k'))
+        self.assertEqual(policy.registry, {'hot': 600})
+        self.assertEqual(self.lfc.get('hot'), [b"h" * 600])
+
+    def test_sync_not_cached(self):
+        """
+        sync stores a file that is not cached yet
+        :return: None
+        """
+        success = self.lfc.sync(self.large_file_path, self.large_file)
+        self.assertTrue(success)
+        self.assertEqual(self.lfc.get_missing_parts(self.large_file_path), [])
+
+    def test_binary_manifest(self):
+        """
+        set stores a binary manifest, and JSON file info stored by earlier
+        versions can still be read
+        :return: None
+        """
+        from lfc.manifest import is_manifest
+        success = self.lfc.set(self.large_file_path, self.large_file)
+        self.assertTrue(success)
+        self.assertTrue(is_manifest(self.lfc._cache.get(self.large_file_path)))
+        self.assertEqual(self.lfc.get_file_info(self.large_file_path)["size"],
+                         MAX_FILE_SIZE)
+
+        file_info = {"checksum": "d41d8cd98f00b204e9800998ecf8427e",
+                     "parts_num": 0}
+        self.lfc._cache.set("legacy", file_info)
+        self.assertEqual(self.lfc.get_file_info("legacy"), file_info)
+        self.assertEqual(self.lfc.get("legacy"), [])
+        self.assertTrue(self.lfc.delete("legacy"))
+
+    def test_admission_policy_keeps_victims_on_failure(self):
+        """
+        The files chosen to make room are only evicted once the new file has
+        been stored
+        :return: None
+        """
+        policy = SizeAwareAdmissionPolicy(budget=MAX_FILE_SIZE)
+        self.lfc.admission_policy = policy
+        self.assertTrue(self.lfc.set(self.large_file_path, self.large_file))
+
+        for _ in range(3):
+            self.lfc.get('popular')
+        self.large_file.seek(0)
+        self.lfc._cache.set_many = mock.MagicMock(return_value=False)
+        self.assertFalse(self.lfc.set('popular', self.large_file))
+
+        self.assertIsNotNone(self.lfc.get_file_info(self.large_file_path))
+        self.assertEqual(policy.registry,
+                         {self.large_file_path: MAX_FILE_SIZE})
+
+    def test_admission_policy_releases_missing_files(self):
+        """
+        Files that memcached expired or evicted are released from the budget
+        once they are found missing
+        :return: None
+        """
+        import io
+        policy = SizeAwareAdmissionPolicy(budget=100)
+        self.lfc.admission_policy = policy
+
+        self.assertTrue(self.lfc.set('a', io.BytesIO(b"a" * 80)))
+        self.assertEqual(policy.registry, {'a': 80})
+
+        # memcached evicts the file
+        self.lfc._cache = MockCache()
+        self.assertFalse(self.lfc.get('a'))
+        self.assertEqual(policy.registry, {})
+        self.assertTrue(self.lfc.set('b', io.BytesIO(b"b" * 50)))
+
+    def test_invalid_binary_manifest(self):
+        """
+        A value that looks like a manifest but cannot be decoded follows
+        raise_on_error, and the key can still be deleted
+        :return: None
+        """
+        self.lfc._cache.set("z", b"LFCM\x01")
+        self.assertFalse(self.lfc.get_file_info("z"))
+        self.assertFalse(self.lfc.get("z"))
+
+        self.lfc.raise_on_error = True
+        with self.assertRaises(ValueError):
+            self.lfc.get("z")
+
+        self.lfc.raise_on_error = False
+        self.assertTrue(self.lfc.delete("z"))
+        self.assertIsNone(self.lfc._cache.get("z"))
+
+    def test_purge(self):
+        """
+        purge removes the parts of a file even when its file info is missing
+        :return: None
+        """
+        success = self.lfc.set(self.large_file_path, self.large_file)
+        self.assertTrue(success)
+        self.lfc._cache.delete(self.large_file_path)
+
+        self.assertTrue(self.lfc.purge(self.large_file_path))
+        self.assertEqual(self.lfc._cache._cache, {})
+
+    def test_set_expire(self):
+        """
+        Negative expirations are stored, the ones memcached cannot take are
+        reported according to raise_on_error
+        :return: None
+        """
+        import io
+        self.assertTrue(self.lfc.set('negative', io.BytesIO(b"a"),
+                                     expire=-1))
+        self.assertEqual(self.lfc.get_file_info('negative')['expire'], -1)
+
+        self.assertFalse(self.lfc.set('huge', io.BytesIO(b"a"),
+                                      expire=2 ** 40))
+        self.assertFalse(self.lfc.sync('negative', io.BytesIO(b"b"),
+                                       expire=2 ** 40))
+        self.lfc.raise_on_error = True
+        with self.assertRaises(ValueError):
+            self.lfc.set('huge', io.BytesIO(b"a"), expire=2 ** 40)
+        self.assertIsNone(self.lfc._cache.get('huge'))
+
     def test_get_file_part_key(self):
         self.lfc.raise_on_error = True
         self.assertTrue(
@@ -0,0 +1,80 @@
+import hashlib
+import unittest
+
+from lfc.manifest import MANIFEST_VERSION, CODEC_NONE, encode_manifest, \
+    decode_manifest, is_manifest
+
+
+class TestManifest(unittest.TestCase):
+    """
+    Tests for the binary manifest format
+    """
+
+    def setUp(self):
+        self.digests = [hashlib.md5(str(i).encode('ascii')).hexdigest()
+                        for i in range(1000)]
+        self.file_info = {"checksum": hashlib.md5(b"file").hexdigest(),
+                          "parts_num": len(self.digests),
+                          "size": 1000 * 1024 * 1024 - 5,
+                          "chunk_size": 1024 * 1024,
+                          "digests": self.digests,
+                          "expire": 3600,
+                          "created": 1500000000}
+
+    def test_round_trip(self):
+        data = encode_manifest(self.file_info)
+        self.assertTrue(is_manifest(data))
+        self.assertEqual(len(data), 46 + 16 * 1000)
+
+        expected = dict(self.file_info, version=MANIFEST_VERSION,
+                        codec=CODEC_NONE)
+        self.assertEqual(decode_manifest(data), expected)
+
+    def test_negative_expire(self):
+        self.file_info["expire"] = -1
+        self.assertEqual(
+            decode_manifest(encode_manifest(self.file_info))["expire"], -1
+        )
+
+    def test_invalid_expire(self):
+        self.file_info["expire"] = 2 ** 40
+        with self.assertRaises(ValueError):
+            encode_manifest(self.file_info)
+
+    def test_no_parts(self):
+        self.file_info.update({"parts_num": 0, "digests": [], "size": 0})
+        decoded = decode_manifest(encode_manifest(self.file_info))
+        self.assertEqual(decoded["digests"], [])
+        self.assertEqual(decoded["parts_num"], 0)
+
+    def test_not_a_manifest(self):
+        self.assertFalse(is_manifest(b'{"parts_num": 1}'))
+        self.assertFalse(is_manifest({"parts_num": 1}))
+        self.assertFalse(is_manifest(None))
+        with self.assertRaises(ValueError):
+            decode_manifest(b'{"parts_num": 1}')
+
+    def test_unsupported_version(self):
+        data = bytearray(encode_manifest(self.file_info))
+        data[4] = MANIFEST_VERSION + 1
+        with self.assertRaises(ValueError) as context:
+            decode_manifest(bytes(data))
+        self.assertTrue('Unsupported manifest version'
+                        in str(context.exception))
+
+    def test_truncated(self):
+        data = encode_manifest(self.file_info)
+        with self.assertRaises(ValueError):
+            decode_manifest(data[:-1])
+        # shorter than the header
+        with self.assertRaises(ValueError):
+            decode_manifest(data[:10])
+
+    def test_wrong_number_of_digests(self):
+        self.file_info["parts_num"] += 1
+        with self.assertRaises(AssertionError):
+            encode_manifest(self.file_info)
+
+
+if __name__ == '__main__':
+    unittest.main()